@@ -0,0 +1,221 @@
+# api/middleware.py
+
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+# Methods that only read data. These get priority over writes when the
+# shared capacity is running out.
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+ADMITTED = 'admitted'
+QUEUE_FULL = 'queue_full'
+TIMED_OUT = 'timed_out'
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 32,
+    'MAX_QUEUE': 64,
+    'READ_RESERVED': 8,
+    'READ_QUEUE_RESERVED': 16,
+    'QUEUE_TIMEOUT': 2.0,
+    'RETRY_AFTER': 1,
+    'ENDPOINTS': {},
+}
+
+
+class Gate:
+    """
+    A concurrency limit with a bounded wait queue.
+    Callers that can't get a slot wait up to `queue_timeout` seconds, but
+    only if fewer than `max_queue` callers are already waiting.
+
+    Priority callers may use every slot and every queue place. Other callers
+    leave `reserved` slots and `queue_reserved` queue places free, and never
+    take a slot while a priority caller is waiting for one.
+    """
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=0.0, reserved=0, queue_reserved=0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.reserved = reserved
+        self.queue_reserved = queue_reserved
+        self.active = 0
+        self.waiting = 0
+        self.waiting_priority = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=False):
+        if priority:
+            limit, queue_limit = self.max_concurrent, self.max_queue
+        else:
+            limit = self.max_concurrent - self.reserved
+            queue_limit = self.max_queue - self.queue_reserved
+
+        def has_slot():
+            return self.active < limit and (priority or self.waiting_priority == 0)
+
+        with self._cond:
+            if has_slot():
+                self.active += 1
+                return ADMITTED
+            if self.waiting >= queue_limit or self.queue_timeout <= 0:
+                return QUEUE_FULL
+
+            self.waiting += 1
+            if priority:
+                self.waiting_priority += 1
+            try:
+                admitted = self._cond.wait_for(has_slot, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+                if priority:
+                    self.waiting_priority -= 1
+                    # Other callers may have been held back only by this one
+                    self._cond.notify_all()
+            if not admitted:
+                return TIMED_OUT
+            self.active += 1
+            return ADMITTED
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+class AdmissionController:
+    """
+    Holds the shared gate, the per-endpoint gates and the shed counters.
+    """
+
+    def __init__(self, config):
+        self.enabled = config['ENABLED']
+        self.retry_after = config['RETRY_AFTER']
+        self.shared = Gate(
+            config['MAX_CONCURRENT'],
+            config['MAX_QUEUE'],
+            config['QUEUE_TIMEOUT'],
+            reserved=config['READ_RESERVED'],
+            queue_reserved=config['READ_QUEUE_RESERVED'],
+        )
+        self.endpoints = {}
+        for name, options in config['ENDPOINTS'].items():
+            self.endpoints[name] = Gate(
+                options['MAX_CONCURRENT'],
+                options.get('MAX_QUEUE', 0),
+                options.get('QUEUE_TIMEOUT', config['QUEUE_TIMEOUT']),
+            )
+        self._counters = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def count(self, endpoint, outcome):
+        with self._lock:
+            self._counters[endpoint][outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        gates = {'shared': self.shared, **self.endpoints}
+        return {
+            'counters': counters,
+            'gates': {
+                name: {
+                    'active': gate.active,
+                    'waiting': gate.waiting,
+                    'waiting_priority': gate.waiting_priority,
+                    'max_concurrent': gate.max_concurrent,
+                    'max_queue': gate.max_queue,
+                }
+                for name, gate in gates.items()
+            },
+        }
+
+
+# Built lazily from settings and shared by the middleware and the stats view
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            config = {**DEFAULTS, **getattr(settings, 'ADMISSION_CONTROL', {})}
+            _controller = AdmissionController(config)
+        return _controller
+
+
+@receiver(setting_changed)
+def reset_controller(setting, **kwargs):
+    # Lets override_settings(ADMISSION_CONTROL=...) take effect
+    global _controller
+    if setting == 'ADMISSION_CONTROL':
+        with _controller_lock:
+            _controller = None
+
+
+def get_admission_stats():
+    return get_controller().snapshot()
+
+
+class AdmissionControlMiddleware:
+    """
+    Sheds load before it reaches the views.
+
+    Every request takes a slot in the shared gate. Reads get priority there:
+    writes leave `READ_RESERVED` slots and `READ_QUEUE_RESERVED` queue places
+    free, so reads like view-loan keep working while check-eligibility is
+    backed up. Writes to endpoints listed in `ENDPOINTS` also get their own
+    limit. A full queue gives 429, a timed-out wait gives 503, both with
+    Retry-After.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        controller = get_controller()
+        if not controller.enabled:
+            return self.get_response(request)
+
+        try:
+            endpoint = resolve(request.path_info).url_name
+        except Resolver404:
+            return self.get_response(request)
+
+        is_read = request.method in READ_METHODS
+        acquired = []
+        try:
+            gate = None if is_read else controller.endpoints.get(endpoint)
+            if gate is not None:
+                outcome = gate.acquire()
+                if outcome != ADMITTED:
+                    return self.shed(controller, endpoint, outcome)
+                acquired.append(gate)
+
+            outcome = controller.shared.acquire(priority=is_read)
+            if outcome != ADMITTED:
+                return self.shed(controller, endpoint, outcome)
+            acquired.append(controller.shared)
+
+            controller.count(endpoint, ADMITTED)
+            return self.get_response(request)
+        finally:
+            for gate in reversed(acquired):
+                gate.release()
+
+    def shed(self, controller, endpoint, outcome):
+        controller.count(endpoint, outcome)
+        if outcome == QUEUE_FULL:
+            response = JsonResponse({"error": "Too many requests, please retry later."}, status=429)
+        else:
+            response = JsonResponse({"error": "Service overloaded, please retry later."}, status=503)
+        response['Retry-After'] = str(controller.retry_after)
+        return response
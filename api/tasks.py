@@ -3,77 +3,95 @@
 import pandas as pd
 from celery import shared_task
 from .models import Customer, Loan
+from django.conf import settings
 from django.db import transaction
+from collections import defaultdict
+from decimal import Decimal
 import math
 from datetime import date
 
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
 @shared_task
 def ingest_data(customer_file_path, loan_file_path):
     """
     Celery task to read customer and loan data and save it to the database.
     This task is now combined and idempotent.
     """
+    chunk_size = getattr(settings, 'INGEST_CHUNK_SIZE', 1000)
     try:
         # --- Ingest Customers ---
-        customer_df = pd.read_excel(customer_file_path)
-        for _, row in customer_df.iterrows():
-            # Use update_or_create to prevent duplicate entries
-            Customer.objects.update_or_create(
-                customer_id=row['Customer ID'],
-                defaults={
-                    'first_name': row['First Name'],
-                    'last_name': row['Last Name'],
-                    'age': row['Age'],
-                    'phone_number': row['Phone Number'],
-                    'monthly_salary': row['Monthly Salary'],
-                    'approved_limit': row['Approved Limit'],
-                }
+        # Records come back as native Python types, which the DB driver can adapt
+        customer_rows = pd.read_excel(customer_file_path).to_dict('records')
+        for chunk in chunked(customer_rows, chunk_size):
+            # Upsert on customer_id to prevent duplicate entries
+            Customer.objects.bulk_create(
+                [
+                    Customer(
+                        customer_id=row['Customer ID'],
+                        first_name=row['First Name'],
+                        last_name=row['Last Name'],
+                        age=row['Age'],
+                        phone_number=row['Phone Number'],
+                        monthly_salary=row['Monthly Salary'],
+                        approved_limit=row['Approved Limit'],
+                    )
+                    for row in chunk
+                ],
+                update_conflicts=True,
+                unique_fields=['customer_id'],
+                update_fields=['first_name', 'last_name', 'age', 'phone_number', 'monthly_salary', 'approved_limit'],
             )
         
         # --- Ingest Loans ---
-        loan_df = pd.read_excel(loan_file_path)
+        loan_rows = pd.read_excel(loan_file_path).to_dict('records')
         all_customer_ids = set(Customer.objects.values_list('customer_id', flat=True))
 
-        for _, row in loan_df.iterrows():
-            customer_id = row['Customer ID']
-            loan_id = row['Loan ID']
-
-            # Only proceed if the customer exists and the loan doesn't
-            if customer_id in all_customer_ids and not Loan.objects.filter(loan_id=loan_id).exists():
-                customer_instance = Customer.objects.get(customer_id=customer_id)
-                Loan.objects.create(
-                    customer=customer_instance,
-                    loan_id=loan_id,
-                    loan_amount=row['Loan Amount'],
-                    tenure=row['Tenure'],
-                    interest_rate=row['Interest Rate'],
-                    monthly_payment=row['Monthly payment'],
-                    emis_paid_on_time=row['EMIs paid on Time'],
-                    start_date=row['Date of Approval'],
-                    end_date=row['End Date']
-                )
+        for chunk in chunked(loan_rows, chunk_size):
+            # Only insert loans whose customer exists; existing loans are skipped
+            Loan.objects.bulk_create(
+                [
+                    Loan(
+                        customer_id=row['Customer ID'],
+                        loan_id=row['Loan ID'],
+                        loan_amount=row['Loan Amount'],
+                        tenure=row['Tenure'],
+                        interest_rate=row['Interest Rate'],
+                        monthly_payment=row['Monthly payment'],
+                        emis_paid_on_time=row['EMIs paid on Time'],
+                        start_date=row['Date of Approval'],
+                        end_date=row['End Date']
+                    )
+                    for row in chunk
+                    if row['Customer ID'] in all_customer_ids
+                ],
+                ignore_conflicts=True,
+            )
 
         # --- Calculate Current Debt ---
+        # Sum remaining principal of active loans per customer in a single pass
+        debts = defaultdict(Decimal)
+        current_loans = Loan.objects.filter(end_date__gte=date.today()).values_list(
+            'customer_id', 'loan_amount', 'tenure', 'emis_paid_on_time'
+        )
+        for customer_id, loan_amount, tenure, emis_paid_on_time in current_loans:
+            # A simple approximation of remaining debt
+            # For a more accurate calculation, an amortization schedule would be needed.
+            # This logic assumes linear repayment for simplicity.
+            if tenure > 0:
+                debts[customer_id] += loan_amount * (tenure - emis_paid_on_time) / tenure
+
         # Use a transaction to ensure data integrity
         with transaction.atomic():
-            for customer in Customer.objects.all():
-                # Find loans that are currently active
-                current_loans = Loan.objects.filter(customer=customer, end_date__gte=date.today())
-                
-                # Calculate remaining principal for each loan
-                total_debt = 0
-                for loan in current_loans:
-                    # A simple approximation of remaining debt
-                    # For a more accurate calculation, an amortization schedule would be needed.
-                    # This logic assumes linear repayment for simplicity.
-                    total_emis = loan.tenure
-                    paid_emis = loan.emis_paid_on_time
-                    if total_emis > 0:
-                        remaining_principal = (loan.loan_amount * (total_emis - paid_emis)) / total_emis
-                        total_debt += remaining_principal
-                
-                customer.current_debt = round(total_debt, 2)
-                customer.save()
+            customers = [
+                Customer(customer_id=customer_id, current_debt=round(debts[customer_id], 2))
+                for customer_id in all_customer_ids
+            ]
+            Customer.objects.bulk_update(customers, ['current_debt'], batch_size=chunk_size)
 
         return "Successfully ingested all data and updated current debts."
 
@@ -1,3 +1,402 @@
-from django.test import TestCase
+# api/tests.py
 
-# Create your tests here.
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pandas as pd
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .middleware import AdmissionControlMiddleware, Gate, get_admission_stats, ADMITTED, QUEUE_FULL, TIMED_OUT
+from .models import Customer, Loan
+from .tasks import ingest_data
+
+# Maximum number of queries each endpoint may run, whatever the portfolio size
+QUERY_BUDGETS = {
+    'register': 2,
+    'check-eligibility': 5,
+    'create-loan': 7,
+    'view-loan': 2,
+    'view-customer-loans': 2,
+}
+
+# Ingest runs one write per chunk of customers, one per chunk of loans and one
+# per batch of current_debt updates. On top of that it reads the customer ids
+# and the active loans, and opens and releases one savepoint.
+INGEST_CHUNK_SIZE = 50
+INGEST_FIXED_QUERIES = 4
+
+# Latency ceilings in seconds for the large portfolio
+LATENCY_CEILINGS = {
+    'check-eligibility': 1.0,
+    'create-loan': 1.0,
+    'view-customer-loans': 2.0,
+}
+
+SMALL_PORTFOLIO = 3
+LARGE_PORTFOLIO = 2000
+
+
+def make_customer(customer_id, num_loans):
+    """
+    Creates a customer with a good repayment history so loans get approved.
+    """
+    customer = Customer.objects.create(
+        customer_id=customer_id,
+        first_name='Test',
+        last_name=f'Customer {customer_id}',
+        age=30,
+        phone_number='9999999999',
+        monthly_salary=100000,
+        approved_limit=10 ** 9,
+    )
+    Loan.objects.bulk_create([
+        Loan(
+            customer=customer,
+            loan_amount=10000,
+            tenure=12,
+            interest_rate=10,
+            monthly_payment=880,
+            emis_paid_on_time=12,
+            start_date=date(2015, 1, 1),
+            end_date=date(2016, 1, 1),
+        )
+        for _ in range(num_loans)
+    ])
+    return customer
+
+
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(
+            len(ctx), budget,
+            f"{len(ctx)} queries run, budget is {budget}:\n" + "\n".join(q['sql'] for q in ctx.captured_queries)
+        )
+        return result
+
+    def assertFasterThan(self, ceiling, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, ceiling, f"took {elapsed:.3f}s, ceiling is {ceiling}s")
+        return result
+
+
+class EndpointQueryBudgetTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.small = make_customer(1, SMALL_PORTFOLIO)
+        cls.large = make_customer(2, LARGE_PORTFOLIO)
+
+    def eligibility_payload(self, customer):
+        return {'customer_id': customer.customer_id, 'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12}
+
+    def test_register(self):
+        payload = {'first_name': 'New', 'last_name': 'Customer', 'age': 25, 'monthly_income': 50000, 'phone_number': '9876543210'}
+        response = self.assertMaxQueries(
+            QUERY_BUDGETS['register'], self.client.post, reverse('register'), payload, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_check_eligibility(self):
+        for customer in (self.small, self.large):
+            response = self.assertMaxQueries(
+                QUERY_BUDGETS['check-eligibility'],
+                self.client.post, reverse('check-eligibility'), self.eligibility_payload(customer), format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data['approval'])
+
+    def test_create_loan(self):
+        for customer in (self.small, self.large):
+            response = self.assertMaxQueries(
+                QUERY_BUDGETS['create-loan'],
+                self.client.post, reverse('create-loan'), self.eligibility_payload(customer), format='json'
+            )
+            self.assertEqual(response.status_code, 201)
+
+    def test_view_loan(self):
+        loan = self.large.loans.first()
+        response = self.assertMaxQueries(
+            QUERY_BUDGETS['view-loan'], self.client.get, reverse('view-loan', args=[loan.loan_id])
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_view_customer_loans(self):
+        for customer, num_loans in ((self.small, SMALL_PORTFOLIO), (self.large, LARGE_PORTFOLIO)):
+            response = self.assertMaxQueries(
+                QUERY_BUDGETS['view-customer-loans'],
+                self.client.get, reverse('view-customer-loans', args=[customer.customer_id])
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), num_loans)
+
+
+class EndpointLatencyTests(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.large = make_customer(1, LARGE_PORTFOLIO)
+
+    def test_check_eligibility(self):
+        payload = {'customer_id': self.large.customer_id, 'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12}
+        response = self.assertFasterThan(
+            LATENCY_CEILINGS['check-eligibility'],
+            self.client.post, reverse('check-eligibility'), payload, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_loan(self):
+        payload = {'customer_id': self.large.customer_id, 'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12}
+        response = self.assertFasterThan(
+            LATENCY_CEILINGS['create-loan'],
+            self.client.post, reverse('create-loan'), payload, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_view_customer_loans(self):
+        response = self.assertFasterThan(
+            LATENCY_CEILINGS['view-customer-loans'],
+            self.client.get, reverse('view-customer-loans', args=[self.large.customer_id])
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+def ingest_budget(num_customers, num_loans):
+    customer_chunks = math.ceil(num_customers / INGEST_CHUNK_SIZE)
+    loan_chunks = math.ceil(num_loans / INGEST_CHUNK_SIZE)
+    debt_batches = math.ceil(num_customers / INGEST_CHUNK_SIZE)
+    return customer_chunks + loan_chunks + debt_batches + INGEST_FIXED_QUERIES
+
+
+@override_settings(INGEST_CHUNK_SIZE=INGEST_CHUNK_SIZE)
+class IngestQueryBudgetTests(QueryBudgetTestCase):
+    LOANS_PER_CUSTOMER = 3
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.customer_file = os.path.join(self.tmpdir, 'customer_data.xlsx')
+        self.loan_file = os.path.join(self.tmpdir, 'loan_data.xlsx')
+
+    def write_customers(self, num_customers, salaries=None):
+        salaries = salaries or {}
+        pd.DataFrame([
+            {
+                'Customer ID': customer_id,
+                'First Name': 'Test',
+                'Last Name': f'Customer {customer_id}',
+                'Age': 30,
+                'Phone Number': 9999999999,
+                'Monthly Salary': salaries.get(customer_id, 100000),
+                'Approved Limit': 3600000,
+            }
+            for customer_id in range(1, num_customers + 1)
+        ]).to_excel(self.customer_file, index=False)
+
+    def write_loans(self, num_customers):
+        today = date.today()
+        pd.DataFrame([
+            {
+                'Customer ID': (loan_id % num_customers) + 1,
+                'Loan ID': loan_id,
+                'Loan Amount': 120000,
+                'Tenure': 12,
+                'Interest Rate': 10.5,
+                'Monthly payment': 10578,
+                'EMIs paid on Time': 6,
+                'Date of Approval': today - timedelta(days=180),
+                'End Date': today + timedelta(days=180),
+            }
+            for loan_id in range(1, num_customers * self.LOANS_PER_CUSTOMER + 1)
+        ]).to_excel(self.loan_file, index=False)
+
+    def test_ingest_queries_grow_only_with_chunks(self):
+        for num_customers in (100, 200):
+            with self.subTest(num_customers=num_customers):
+                Customer.objects.all().delete()
+                self.write_customers(num_customers)
+                self.write_loans(num_customers)
+                num_loans = num_customers * self.LOANS_PER_CUSTOMER
+
+                result = self.assertMaxQueries(
+                    ingest_budget(num_customers, num_loans),
+                    ingest_data.delay, self.customer_file, self.loan_file
+                )
+
+                self.assertTrue(result.get().startswith("Successfully"), result.get())
+                self.assertEqual(Customer.objects.count(), num_customers)
+                self.assertEqual(Loan.objects.count(), num_loans)
+                # Half of each 120000 loan is left to repay, three loans per customer
+                self.assertEqual(Customer.objects.get(customer_id=1).current_debt, 180000)
+
+    def test_reingest_updates_changed_customers(self):
+        self.write_customers(200)
+        self.write_loans(200)
+        ingest_data.delay(self.customer_file, self.loan_file)
+
+        self.write_customers(200, salaries={1: 250000})
+        ingest_data.delay(self.customer_file, self.loan_file)
+
+        self.assertEqual(Customer.objects.count(), 200)
+        self.assertEqual(Loan.objects.count(), 200 * self.LOANS_PER_CUSTOMER)
+        customer = Customer.objects.get(customer_id=1)
+        self.assertEqual(customer.monthly_salary, 250000)
+        self.assertEqual(customer.current_debt, Decimal('180000.00'))
+
+
+class GateTests(SimpleTestCase):
+    def test_admits_up_to_limit(self):
+        gate = Gate(max_concurrent=2)
+        self.assertEqual(gate.acquire(), ADMITTED)
+        self.assertEqual(gate.acquire(), ADMITTED)
+        self.assertEqual(gate.acquire(), QUEUE_FULL)
+
+    def test_queued_request_times_out(self):
+        gate = Gate(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        gate.acquire()
+        self.assertEqual(gate.acquire(), TIMED_OUT)
+
+    def test_queued_request_admitted_after_release(self):
+        gate = Gate(max_concurrent=1, max_queue=1, queue_timeout=2.0)
+        gate.acquire()
+        threading.Timer(0.05, gate.release).start()
+        self.assertEqual(gate.acquire(), ADMITTED)
+
+    def test_reserved_slots_kept_for_priority_callers(self):
+        gate = Gate(max_concurrent=2, reserved=1)
+        self.assertEqual(gate.acquire(), ADMITTED)
+        self.assertEqual(gate.acquire(), QUEUE_FULL)
+        self.assertEqual(gate.acquire(priority=True), ADMITTED)
+
+    def test_reserved_queue_places_and_wakeup_favor_priority_callers(self):
+        gate = Gate(max_concurrent=1, max_queue=2, queue_timeout=2.0, queue_reserved=1)
+        gate.acquire()
+
+        # A write waits in the only queue place open to writes
+        write_results = []
+        writer = threading.Thread(target=lambda: write_results.append(gate.acquire()))
+        writer.start()
+        while gate.waiting < 1:
+            time.sleep(0.01)
+        self.assertEqual(gate.acquire(), QUEUE_FULL)
+
+        # A read still gets a queue place, and takes the freed slot first
+        threading.Timer(0.05, gate.release).start()
+        self.assertEqual(gate.acquire(priority=True), ADMITTED)
+        self.assertEqual(write_results, [])
+
+        gate.release()
+        writer.join(5)
+        self.assertEqual(write_results, [ADMITTED])
+
+
+ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 2,
+    'MAX_QUEUE': 0,
+    'READ_RESERVED': 1,
+    'READ_QUEUE_RESERVED': 0,
+    'QUEUE_TIMEOUT': 0.05,
+    'RETRY_AFTER': 7,
+    'ENDPOINTS': {
+        'check-eligibility': {'MAX_CONCURRENT': 1, 'MAX_QUEUE': 0},
+    },
+}
+
+
+class AdmissionControlMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        # Overriding per test gives every test a fresh controller and counters
+        override = override_settings(ADMISSION_CONTROL=ADMISSION_CONTROL)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.factory = RequestFactory()
+        self.middleware = AdmissionControlMiddleware(self.view)
+
+    def view(self, request):
+        # Requests marked by hold() stay in the view until released
+        if hasattr(request, 'release'):
+            request.entered.set()
+            request.release.wait(5)
+        return HttpResponse('ok')
+
+    def request(self, method, path):
+        return self.middleware(getattr(self.factory, method)(path))
+
+    def hold(self, method, path):
+        request = getattr(self.factory, method)(path)
+        request.entered = threading.Event()
+        request.release = threading.Event()
+        thread = threading.Thread(target=self.middleware, args=(request,))
+        thread.start()
+        self.assertTrue(request.entered.wait(5))
+
+        def stop():
+            request.release.set()
+            thread.join(5)
+        self.addCleanup(stop)
+
+    def test_full_queue_returns_429(self):
+        self.hold('post', '/api/check-eligibility/')
+
+        response = self.request('post', '/api/check-eligibility/')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(get_admission_stats()['counters']['check-eligibility'], {ADMITTED: 1, QUEUE_FULL: 1})
+
+    def test_timed_out_wait_returns_503(self):
+        config = {**ADMISSION_CONTROL, 'ENDPOINTS': {'check-eligibility': {'MAX_CONCURRENT': 1, 'MAX_QUEUE': 1}}}
+        with self.settings(ADMISSION_CONTROL=config):
+            self.hold('post', '/api/check-eligibility/')
+
+            response = self.request('post', '/api/check-eligibility/')
+
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '7')
+            self.assertEqual(get_admission_stats()['counters']['check-eligibility'], {ADMITTED: 1, TIMED_OUT: 1})
+
+    def test_reads_get_through_when_writes_are_shed(self):
+        self.hold('post', '/api/check-eligibility/')
+
+        # The endpoint gate is full, and the shared gate has no slot left for writes
+        self.assertEqual(self.request('post', '/api/check-eligibility/').status_code, 429)
+        self.assertEqual(self.request('post', '/api/register/').status_code, 429)
+
+        # Reads skip the endpoint gate and use the slot kept for them
+        self.assertEqual(self.request('get', '/api/view-loan/1/').status_code, 200)
+        self.assertEqual(self.request('get', '/api/check-eligibility/').status_code, 200)
+        self.assertEqual(get_admission_stats()['counters']['view-loan'], {ADMITTED: 1})
+
+    def test_stats_endpoint_reports_shed_requests(self):
+        self.hold('post', '/api/check-eligibility/')
+        self.request('post', '/api/check-eligibility/')
+
+        response = APIClient().get(reverse('admission-stats'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['counters']['check-eligibility'], {ADMITTED: 1, QUEUE_FULL: 1})
+        self.assertEqual(response.data['gates']['check-eligibility']['active'], 1)
+
+    def test_disabled_admits_everything(self):
+        with self.settings(ADMISSION_CONTROL={**ADMISSION_CONTROL, 'ENABLED': False}):
+            self.hold('post', '/api/check-eligibility/')
+
+            self.assertEqual(self.request('post', '/api/check-eligibility/').status_code, 200)
+            self.assertEqual(get_admission_stats()['counters'], {})
@@ -6,7 +6,8 @@ from .views import (
     CheckEligibilityView, 
     CreateLoanView, 
     ViewLoanView, 
-    ViewCustomerLoansView
+    ViewCustomerLoansView,
+    AdmissionStatsView
 )
 
 urlpatterns = [
@@ -15,4 +16,5 @@ urlpatterns = [
     path('create-loan/', CreateLoanView.as_view(), name='create-loan'),
     path('view-loan/<int:loan_id>/', ViewLoanView.as_view(), name='view-loan'),
     path('view-loans/<int:customer_id>/', ViewCustomerLoansView.as_view(), name='view-customer-loans'),
+    path('admission-stats/', AdmissionStatsView.as_view(), name='admission-stats'),
 ]
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from .models import Customer, Loan
 from .serializers import CustomerSerializer, LoanSerializer, LoanDetailSerializer, CustomerLoanSerializer
+from .middleware import get_admission_stats
 from django.db.models import Sum
 from datetime import date
 import math
@@ -224,3 +225,9 @@ class ViewCustomerLoansView(APIView):
             return Response(serializer.data)
         except Customer.DoesNotExist:
             return Response({"error": "Customer not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class AdmissionStatsView(APIView):
+    def get(self, request):
+        # Counters of admitted and shed requests per endpoint
+        return Response(get_admission_stats())
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -128,3 +129,24 @@ CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELery_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+
+# Number of rows written per query by the ingest_data task
+INGEST_CHUNK_SIZE = 1000
+
+# Admission control (see api/middleware.py)
+# Limits how many requests run at once so a slow DB sheds load instead of
+# blocking every worker. Writes leave READ_RESERVED slots and
+# READ_QUEUE_RESERVED queue places free for reads.
+ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 32,
+    'MAX_QUEUE': 64,
+    'READ_RESERVED': 8,
+    'READ_QUEUE_RESERVED': 16,
+    'QUEUE_TIMEOUT': 2.0,  # seconds a request may wait for a slot
+    'RETRY_AFTER': 1,  # seconds, sent in the Retry-After header
+    'ENDPOINTS': {
+        'check-eligibility': {'MAX_CONCURRENT': 8, 'MAX_QUEUE': 16},
+        'create-loan': {'MAX_CONCURRENT': 4, 'MAX_QUEUE': 8},
+    },
+}
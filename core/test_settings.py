@@ -0,0 +1,19 @@
+# core/test_settings.py
+
+# Settings for running the test suite locally without Postgres or Redis:
+#   python manage.py test --settings=core.test_settings
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+# Run Celery tasks inline
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True